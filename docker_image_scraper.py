@@ -3,65 +3,268 @@ A script that fetches Docker image tags, updates a local JSON file,
 and optionally syncs with an API, including deleting outdated tags.
 """
 
+import heapq
+import ijson
+import io
 import json
+import math
+import orjson
 import os
 import re
-import requests
 import concurrent.futures
 import argparse
+from functools import lru_cache
+from operator import itemgetter
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from urllib3.util.retry import Retry
+
+try:
+    import re2  # Optional: google-re2, a linear-time DFA engine.
+except ImportError:
+    re2 = None
 
 API_URL = "https://api.example.com"  # Replace with the actual API URL
 API_TOKEN = os.getenv("X_API_TOKEN")  # Token should be set as an environment variable
 
-def get_docker_image_tags(image):
+# Worker-pool width per phase; the HTTP connection pool is sized to the
+# total number of threads so no thread ever blocks waiting for a free
+# connection and no one-shot sockets get opened past the pool.
+_POOL_SIZE = 16
+
+# One session for every Docker Hub and API call so the TCP/TLS connections
+# are kept alive and reused instead of being re-established per request.
+# GET responses are also cached on disk for 5 minutes, so a quick re-run
+# replays still-fresh Docker Hub pages without any network I/O; POST and
+# DELETE bypass the cache.
+_SESSION = CachedSession(
+    '.docker_hub_cache',
+    backend='sqlite',
+    expire_after=300,
+    allowable_methods=('GET',),
+)
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=2 * _POOL_SIZE,
+    pool_maxsize=2 * _POOL_SIZE,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
+# Shared worker pool for the per-image phases (tag scraping, API
+# deletions). Pagination prefetch runs on its own pool: those jobs are
+# submitted from inside scrape workers, and nesting them into the same
+# bounded pool could leave every worker blocked waiting on page fetches
+# that have no thread left to run on.
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=_POOL_SIZE)
+_PAGE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=_POOL_SIZE)
+
+# Sidecar cache of the ETag Docker Hub returned per first-page URL, used to
+# send conditional GETs so unchanged repositories cost a single 304
+# round-trip instead of a full re-download.
+_ETAG_CACHE_PATH = '.etag_cache.json'
+
+
+def _load_etag_cache():
+    if os.path.exists(_ETAG_CACHE_PATH):
+        with open(_ETAG_CACHE_PATH, 'rb') as f:
+            try:
+                return orjson.loads(f.read())
+            except orjson.JSONDecodeError:
+                # A corrupt cache only costs one full refetch per image.
+                return {}
+    return {}
+
+
+_ETAG_CACHE = _load_etag_cache()
+
+
+def _save_etag_cache():
+    with open(f'{_ETAG_CACHE_PATH}.tmp', 'wb') as f:
+        f.write(orjson.dumps(_ETAG_CACHE))
+    os.replace(f'{_ETAG_CACHE_PATH}.tmp', _ETAG_CACHE_PATH)
+
+
+# Matches version-like tags such as "1.25.4", "16.2" or "v2", capturing the
+# version without any leading "v". Compiled once so the per-tag loops below
+# don't pay the re module's pattern-cache lookup on every call.
+_VER_RE = re.compile(r'v?(\d+(?:\.\d+){0,2})')
+
+# With re2 available, a whole page of tags is matched in one C-level scan
+# over a newline-joined batch instead of one Python match call per tag.
+if re2 is not None:
+    _VER_BATCH_RE = re2.compile(r'^v?(\d+(?:\.\d+){0,2})', re2.MULTILINE)
+
+
+def _extract_versions(tags):
+    """
+    Extracts unique versions from a list of tag names.
+
+    Args:
+        tags (list): Tag names as returned by Docker Hub.
+
+    Returns:
+        dict: Mapping of version string to its integer tuple sort key.
+    """
+    if re2 is not None:
+        found = _VER_BATCH_RE.findall('\n'.join(tags))
+    else:
+        found = (match.group(1) for match in map(_VER_RE.match, tags) if match)
+
+    versions = {}
+    for version in found:
+        if version not in versions:
+            versions[version] = tuple(int(part) for part in version.split('.'))
+    return versions
+
+def _canon(name):
+    """
+    Normalizes a service name to its canonical "owner/repo" form.
+
+    Aliases such as "nginx", "library/nginx" and
+    "https://hub.docker.com/r/library/nginx" all map to the same repo,
+    so canonicalizing before the scrape keeps them from being fetched
+    more than once.
+
+    Args:
+        name (str): The service name as listed in services.json.
+
+    Returns:
+        str: The canonical "owner/repo" identifier.
+    """
+    name = name.strip().rstrip('/')
+    for prefix in ("https://hub.docker.com/r/", "http://hub.docker.com/r/",
+                   "hub.docker.com/r/", "docker.io/"):
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+            break
+    if "/" not in name:
+        name = f"library/{name}"
+    return name
+
+
+@lru_cache(maxsize=None)
+def get_docker_image_tags(image, use_etag=True):
     """
     Fetches and filters Docker image tags from Docker Hub.
+    Results are memoized per image so duplicate service entries
+    don't trigger a second full scrape.
 
     Args:
         image (str): The name of the Docker image.
+        use_etag (bool): Whether a conditional GET may be sent. Pass
+            False when no stored tags exist to fall back on, forcing a
+            full fetch instead of a possible 304.
 
     Returns:
-        list: List of the latest 5 unique version tags sorted in descending order.
+        list: List of the latest 10 unique version tags sorted in descending
+            order, or None when Docker Hub reports the tags as unchanged.
     """
-    tags = []
+    # Docker Hub orders tags by last push date, not by version, so a high
+    # version pushed long ago can sit on a later page. Stop paginating only
+    # once 10 unique versions are known and the most recent page's best
+    # version already sorts below the 10th-best seen so far — i.e. the
+    # pages have aged past the point where they still shuffle the top 10.
+    # This is still a heuristic: an old enough high-version tag deeper in
+    # the history would be missed, but a page that can't crack the top 10
+    # makes that increasingly unlikely.
+    seen_versions = {}
+
+    def _have_enough(page_tags):
+        page_versions = _extract_versions(page_tags)
+        seen_versions.update(page_versions)
+        if len(seen_versions) < 10:
+            return False
+        if not page_versions:
+            return True
+        tenth_best = heapq.nlargest(10, seen_versions.values())[-1]
+        return max(page_versions.values()) < tenth_best
 
     if "/" in image:
         username, repo_name = image.split("/")
-        tags.extend(get_docker_image_tags_specific_repo(username, repo_name))
+        tags = get_docker_image_tags_specific_repo(username, repo_name, on_page=_have_enough, use_etag=use_etag)
     else:
-        tags.extend(get_docker_image_tags_official_repo(image))
+        tags = get_docker_image_tags_official_repo(image, on_page=_have_enough, use_etag=use_etag)
 
-    version_tags = [tag for tag in tags if re.match(r'v?\d+(\.\d+){0,2}', tag)]
-    versions = [{'version': re.match(r'v?(\d+(\.\d+){0,2})', tag).group(1), 'major': re.match(r'v?(\d+)', tag).group(1)} for tag in version_tags]
-    unique_versions = []
-    seen_versions = set()
+    if tags is None:
+        return None
 
-    for version in sorted(versions, key=lambda v: tuple(map(int, v['version'].split('.'))), reverse=True):
-        if version['version'] not in seen_versions:
-            seen_versions.add(version['version'])
-            unique_versions.append(version)
+    versions = _extract_versions(tags)
+    newest = heapq.nlargest(10, versions.items(), key=itemgetter(1))
+    return [{'version': version, 'major': str(key[0])} for version, key in newest]
 
-    return unique_versions[:10]
 
-
-def get_docker_image_tags_official_repo(image):
+def get_docker_image_tags_official_repo(image, on_page=None, use_etag=True):
     url = f"https://registry.hub.docker.com/v2/repositories/library/{image}/tags?page_size=1000"
-    return _fetch_and_parse_tags(url)
+    return _fetch_and_parse_tags(url, on_page=on_page, use_etag=use_etag)
 
 
-def get_docker_image_tags_specific_repo(username, repo_name):
+def get_docker_image_tags_specific_repo(username, repo_name, on_page=None, use_etag=True):
     url = f"https://registry.hub.docker.com/v2/repositories/{username}/{repo_name}/tags?page_size=1000"
-    return _fetch_and_parse_tags(url)
+    return _fetch_and_parse_tags(url, on_page=on_page, use_etag=use_etag)
+
+
+def _fetch_page(url):
+    response = _SESSION.get(url, timeout=300)
+    response.raise_for_status()
+    return response.json()
 
 
-def _fetch_and_parse_tags(url):
-    tags = []
-    while url:
-        response = requests.get(url, timeout=300)
+def _stream_page_names(url):
+    # A tag page carries layers, digests and timestamps we never look at;
+    # stream-parse the response and pull out only the tag names instead of
+    # materializing every field with response.json().
+    with _SESSION.get(url, timeout=300, stream=True) as response:
         response.raise_for_status()
-        data = response.json()
-        tags.extend([result["name"] for result in data["results"]])
-        url = data.get("next")
+        if getattr(response, 'from_cache', False):
+            # Cache replays can't be streamed: ijson probes with read(0),
+            # which CachedHTTPResponse treats as EOF and closes its buffer.
+            # The body is already in memory, so parse it from there.
+            stream = io.BytesIO(response.content)
+        else:
+            response.raw.decode_content = True
+            stream = response.raw
+        return list(ijson.items(stream, 'results.item.name'))
+
+
+def _fetch_and_parse_tags(url, on_page=None, use_etag=True):
+    headers = {}
+    if use_etag and url in _ETAG_CACHE:
+        headers["If-None-Match"] = _ETAG_CACHE[url]
+
+    response = _SESSION.get(url, timeout=300, headers=headers)
+    if response.status_code == 304:
+        # Nothing changed upstream; the caller reuses the stored tags.
+        return None
+    response.raise_for_status()
+
+    etag = response.headers.get("ETag")
+    if etag:
+        _ETAG_CACHE[url] = etag
+
+    data = response.json()
+    tags = [result["name"] for result in data["results"]]
+
+    # on_page sees each page as it arrives; True means stop paginating.
+    if on_page and on_page(tags):
+        return tags
+
+    count = data.get("count")
+    if count:
+        # The first response tells us how many tags exist in total, so the
+        # remaining pages can be fetched in parallel instead of walking the
+        # "next" links one round-trip at a time.
+        pages = math.ceil(count / 1000)
+        page_urls = [f"{url}&page={page}" for page in range(2, pages + 1)]
+        for page_names in _PAGE_EXECUTOR.map(_stream_page_names, page_urls):
+            tags.extend(page_names)
+    else:
+        next_url = data.get("next")
+        while next_url:
+            data = _fetch_page(next_url)
+            page_names = [result["name"] for result in data["results"]]
+            tags.extend(page_names)
+            if on_page and on_page(page_names):
+                break
+            next_url = data.get("next")
     return tags
 
 def fetch_all_container_images():
@@ -71,7 +274,7 @@ def fetch_all_container_images():
     Returns:
         list: A list of all images with their IDs and names.
     """
-    response = requests.get(f"{API_URL}/container-images", headers={"X-API-TOKEN": API_TOKEN})
+    response = _SESSION.get(f"{API_URL}/container-images", headers={"X-API-TOKEN": API_TOKEN})
     response.raise_for_status()
     return response.json()
 
@@ -85,7 +288,7 @@ def fetch_image_versions(image_name):
     Returns:
         list: A list of version strings for the specified image.
     """
-    response = requests.get(f"{API_URL}/container-image-versions/{image_name}", headers={"X-API-TOKEN": API_TOKEN})
+    response = _SESSION.get(f"{API_URL}/container-image-versions/{image_name}", headers={"X-API-TOKEN": API_TOKEN})
     response.raise_for_status()
     return response.json()
 
@@ -101,7 +304,7 @@ def send_to_api(updated_tags):
             {"name": image, "versions": tags} for image, tags in updated_tags.items()
         ]
     }
-    response = requests.post(f"{API_URL}/container-images", json=payload, headers={"X-API-TOKEN": API_TOKEN})
+    response = _SESSION.post(f"{API_URL}/container-images", json=payload, headers={"X-API-TOKEN": API_TOKEN})
     response.raise_for_status()
 
 def delete_container_image(image_id):
@@ -111,9 +314,27 @@ def delete_container_image(image_id):
     Args:
         image_id (str): ID of the container image to delete.
     """
-    response = requests.delete(f"{API_URL}/container-images/{image_id}", headers={"X-API-TOKEN": API_TOKEN})
+    response = _SESSION.delete(f"{API_URL}/container-images/{image_id}", headers={"X-API-TOKEN": API_TOKEN})
     response.raise_for_status()
 
+def _write_all_tags(all_tags):
+    """
+    Serializes the tag database to all_tags.json, skipping the write
+    entirely when the contents are unchanged.
+
+    Args:
+        all_tags (dict): Mapping of image names to their version lists.
+    """
+    serialized = orjson.dumps(all_tags, option=orjson.OPT_INDENT_2)
+    if os.path.exists('all_tags.json'):
+        with open('all_tags.json', 'rb') as f:
+            if f.read() == serialized:
+                return
+    with open('all_tags.json.tmp', 'wb') as f:
+        f.write(serialized)
+    os.replace('all_tags.json.tmp', 'all_tags.json')
+
+
 def compare_and_identify_deletions(image_name, latest_tags, api_tags):
     """
     Compares the latest tags with the API tags to identify outdated versions.
@@ -126,7 +347,7 @@ def compare_and_identify_deletions(image_name, latest_tags, api_tags):
     Returns:
         list: Tags from the API that are not in the latest tags (outdated tags).
     """
-    latest_versions = [tag['version'] for tag in latest_tags]
+    latest_versions = {tag['version'] for tag in latest_tags}
     outdated_versions = [tag for tag in api_tags if tag not in latest_versions]
     return outdated_versions
 
@@ -139,34 +360,55 @@ def main(enable_api=False):
         services = json.load(f)
 
     updated_tags = {}
-    if not os.path.exists('all_tags.json'):
-        with open('all_tags.json', 'w', encoding='utf-8') as f:
-            json.dump({}, f, indent=4)
-
-    with open('all_tags.json', 'r', encoding='utf-8') as f:
-        all_tags = json.load(f)
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {executor.submit(get_docker_image_tags, service['name']): service['name'] for service in services}
-
-        for future in concurrent.futures.as_completed(futures):
-            image = futures[future]
-            try:
-                new_tags = future.result()
-            except Exception as e:
-                print(f'Error fetching tags for {image}: {e}')
-                continue
-
+    if os.path.exists('all_tags.json'):
+        with open('all_tags.json', 'rb') as f:
+            all_tags = orjson.loads(f.read())
+        # Migrate entries written before the lists were capped at 10.
+        all_tags = {image: tags[:10] for image, tags in all_tags.items()}
+    else:
+        all_tags = {}
+
+    canonical_names = {}
+    for service in services:
+        canonical_names.setdefault(_canon(service['name']), set()).add(service['name'])
+
+    futures = {}
+    for canonical, names in canonical_names.items():
+        # A 304 answer is only useful when every alias still has stored
+        # tags to fall back on; otherwise (fresh all_tags.json, new alias)
+        # force a full fetch so the image doesn't stay empty until the
+        # upstream ETag changes.
+        use_etag = all(all_tags.get(name) for name in names)
+        futures[_EXECUTOR.submit(get_docker_image_tags, canonical, use_etag)] = canonical
+
+    for future in concurrent.futures.as_completed(futures):
+        canonical = futures[future]
+        try:
+            new_tags = future.result()
+        except Exception as e:
+            print(f'Error fetching tags for {canonical}: {e}')
+            continue
+
+        if new_tags is None:
+            # 304 Not Modified: the stored tags are still current.
+            continue
+
+        # all_tags stays keyed by the names used in services.json, so one
+        # scrape may update several aliased entries.
+        for image in canonical_names[canonical]:
             current_tags = all_tags.get(image, [])
-            current_versions = [tag['version'] for tag in current_tags]
+            current_versions = {tag['version'] for tag in current_tags}
             newer_tags = [tag for tag in new_tags if tag['version'] not in current_versions]
             if newer_tags:
-                updated_tags[image] = newer_tags + current_tags
+                # Only the newest 10 versions are ever used downstream, so
+                # keep the stored list from growing with every run.
+                updated_tags[image] = (newer_tags + current_tags)[:10]
+
+    _save_etag_cache()
 
     if updated_tags:
         all_tags.update(updated_tags)
-        with open('all_tags.json', 'w', encoding='utf-8') as f:
-            json.dump(all_tags, f, indent=4)
+        _write_all_tags(all_tags)
 
         if enable_api and API_TOKEN:
             send_to_api(updated_tags)
@@ -174,9 +416,12 @@ def main(enable_api=False):
             for image_name in updated_tags.keys():
                 api_tags = fetch_image_versions(image_name)
                 outdated_tags = compare_and_identify_deletions(image_name, updated_tags[image_name], api_tags)
-                for outdated_version in outdated_tags:
-                    print(f"Deleting outdated version '{outdated_version}' for image '{image_name}'")
-                    delete_container_image(outdated_version)
+                if outdated_tags:
+                    for outdated_version in outdated_tags:
+                        print(f"Deleting outdated version '{outdated_version}' for image '{image_name}'")
+                    # The API has no bulk-delete endpoint, so issue the
+                    # DELETEs concurrently instead of one round-trip at a time.
+                    list(_EXECUTOR.map(delete_container_image, outdated_tags))
 
         print('Updated tags written to all_tags.json')
     else:
@@ -0,0 +1,95 @@
+"""
+Tests for the Docker Hub tag scraper.
+"""
+
+import io
+from unittest import mock
+
+import docker_image_scraper as scraper
+
+_PAGE_BODY = b'{"results": [{"name": "1.25.4", "digest": "sha256:x"}, {"name": "1.25.3"}]}'
+
+
+class _LiveRaw(io.BytesIO):
+    """A live urllib3 body: a plain readable stream."""
+
+
+class _CachedRaw:
+    """
+    Mimics requests-cache's CachedHTTPResponse, whose read() treats an
+    empty read as EOF and closes the underlying buffer.
+    """
+
+    def __init__(self, body):
+        self._buffer = io.BytesIO(body)
+
+    def read(self, amt=None):
+        if amt == 0:
+            self._buffer.close()
+            return b''
+        return self._buffer.read(amt)
+
+
+class _FakeResponse:
+    def __init__(self, body, from_cache):
+        self.content = body
+        self.from_cache = from_cache
+        self.raw = _CachedRaw(body) if from_cache else _LiveRaw(body)
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_stream_page_names_live_response():
+    response = _FakeResponse(_PAGE_BODY, from_cache=False)
+    with mock.patch.object(scraper._SESSION, 'get', return_value=response):
+        assert scraper._stream_page_names('url') == ['1.25.4', '1.25.3']
+
+
+class _PageResponse:
+    def __init__(self, body):
+        self.status_code = 200
+        self.headers = {}
+        self._body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._body
+
+
+def test_pagination_does_not_stop_before_better_version():
+    # Regression test: Docker Hub orders tags by push date, not version,
+    # so 10+ recently rebuilt 1.9.x tags on page 1 must not early-exit
+    # past a once-pushed 2.0.0 on page 2.
+    pages = {
+        'page1': _PageResponse({
+            'results': [{'name': f'1.9.{i}'} for i in range(12)],
+            'next': 'page2',
+        }),
+        'page2': _PageResponse({'results': [{'name': '2.0.0'}]}),
+    }
+    scraper._ETAG_CACHE.clear()
+    with mock.patch.object(scraper._SESSION, 'get',
+                           side_effect=lambda url, timeout=None, headers=None: pages[url]):
+        with mock.patch.object(
+                scraper, 'get_docker_image_tags_specific_repo',
+                side_effect=lambda u, r, on_page=None, use_etag=True:
+                    scraper._fetch_and_parse_tags('page1', on_page=on_page, use_etag=use_etag)):
+            result = scraper.get_docker_image_tags.__wrapped__('library/whatever')
+    assert result[0] == {'version': '2.0.0', 'major': '2'}
+
+
+def test_stream_page_names_cached_response():
+    # Regression test: on a cache hit the raw stream can't serve ijson's
+    # read(0) probe, so the buffered body must be parsed instead.
+    response = _FakeResponse(_PAGE_BODY, from_cache=True)
+    with mock.patch.object(scraper._SESSION, 'get', return_value=response):
+        assert scraper._stream_page_names('url') == ['1.25.4', '1.25.3']